@@ -1,16 +1,12 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib import collections  as mc
-
 from scipy.spatial import Delaunay
 from scipy.spatial import ConvexHull
-from scipy.spatial import delaunay_plot_2d
-from scipy.spatial import convex_hull_plot_2d
 from random import randint
 import numpy as np
+import math
 import time
 import itertools
 import Tools as tools
+import Storage as storage
 
 from MyGraph import MyGraph, Piece
 
@@ -20,8 +16,15 @@ class Kirkpatrick:
 	MAX_DEGREE = 8
 	# first 3 points in list are the bounding triangle
 	POINT_START = 3
-
-	def __init__(self, points):
+	# fraction of the most queried candidate vertices kept out of each independent set
+	# when building with query weights
+	DEFER_FRACTION = 0.5
+
+	# <queryWeights> optionally describes where queries are expected, either as a sample of
+	# query points or as a function giving the query density at a point. Vertices in heavily
+	# queried regions are then removed as late as possible, so the triangles there are
+	# reached after fewer steps down the DAG
+	def __init__(self, points, queryWeights=None):
 		# all initial instance variables
 		self.points = [tools.roundPoint(point) for point in points]
 		# an instance of <MyGraph> used to build DAG location structure
@@ -32,10 +35,17 @@ class Kirkpatrick:
 		self.untouchedG = None
 		# total number of points
 		self.N = 0
+		# per-vertex values used by <interpolate>, one per input point
+		self.values = None
+		# convex hull of the points, as an h x 2 array of coordinates in counterclockwise order
+		self.hull = None
+		# expected query weight around each vertex, None for a uniform build
+		self.vertexWeights = None
 
 		# get convex hull of graph before adding bounding triangle
 		ch = ConvexHull(self.points)
 		interior = [i + Kirkpatrick.POINT_START for i in ch.vertices]
+		self.hull = np.asarray(self.points, dtype=float)[ch.vertices]
 
 		# add bounding triangle to graph
 		boundingTriangle = self.getBoundingTriangle(self.points)
@@ -54,14 +64,18 @@ class Kirkpatrick:
 			pieces.append(Piece(triangle, isLeaf=True, isInside=False))
 
 		# now get interior triangulation and add to pieces collection
-		interiorTri = Delaunay(points)
-		interiorTri = [[i + Kirkpatrick.POINT_START for i in tri] for tri in interiorTri.simplices]
+		delaunay = Delaunay(points)
+		interiorTri = [[i + Kirkpatrick.POINT_START for i in tri] for tri in delaunay.simplices]
 		for triangle in interiorTri:
 			pieces.append(Piece(triangle, isLeaf=True, isInside=True))
 		
 		# number of points in graph
 		self.N = len(self.points)
 
+		# weigh vertices by the queries landing in their triangles
+		if (queryWeights is not None):
+			self.vertexWeights = self.getVertexWeights(delaunay, queryWeights)
+
 		# have all the points, now create graph
 		self.g = MyGraph(self.points, pieces)
 		self.untouchedG = MyGraph(self.points, pieces)
@@ -99,16 +113,38 @@ class Kirkpatrick:
 		boxCorner = [xMin, yMax]
 		m = (boxCorner[1] - tip[1])/(boxCorner[0] - tip[0])
 		b = boxCorner[1] - m * boxCorner[0]
-		leftCorner = [((yMin - b)/m)*1.5, yMin]
+		# widen around the middle (not the origin) so points far from the origin stay inside
+		leftCorner = [tip[0] + ((yMin - b)/m - tip[0])*1.5, yMin]
 
 		# right corner
 		boxCorner = [xMax, yMax]
 		m = (boxCorner[1] - tip[1])/(boxCorner[0] - tip[0])
 		b = boxCorner[1] - m * boxCorner[0]
-		rightCorner = [((yMin - b)/m)*1.5, yMin]
+		rightCorner = [tip[0] + ((yMin - b)/m - tip[0])*1.5, yMin]
 
 		return [leftCorner, tip, rightCorner]
 
+	# get the expected query weight around each vertex from <queryWeights> (see constructor)
+	# weight of a vertex is the sum of the weights of the interior triangles around it
+	def getVertexWeights(self, delaunay, queryWeights):
+		simplices = delaunay.simplices
+
+		if callable(queryWeights):
+			# density at the triangle's center times its area
+			corners = delaunay.points[simplices]
+			centers = corners.mean(axis=1)
+			areas = np.abs(np.array([tools.area2(c[0], c[1], c[2]) for c in corners])) / 2
+			triangleWeights = np.array([queryWeights(center) for center in centers]) * areas
+		else:
+			# number of sample queries in each triangle, queries outside the hull are ignored
+			found = delaunay.find_simplex(np.asarray(queryWeights, dtype=float).reshape(-1, 2))
+			triangleWeights = np.bincount(found[found >= 0], minlength=len(simplices)).astype(float)
+
+		weights = np.zeros(self.N)
+		for corner in xrange(0, 3):
+			np.add.at(weights, simplices[:, corner] + Kirkpatrick.POINT_START, triangleWeights)
+		return weights
+
 	# find an independent set using <self.g> and return
 	# used by constructor for building kirkpatrick's DAG datastructure
 	def findIndependentSet(self):
@@ -125,11 +161,23 @@ class Kirkpatrick:
 			elif self.g.degree(i) > Kirkpatrick.MAX_DEGREE:
 				marked[i] = True
 
+		candidates = range(Kirkpatrick.POINT_START, self.N)
+
+		# with query weights, try the least queried vertices first and leave the most
+		# queried ones for a later layer
+		if (self.vertexWeights is not None):
+			candidates = [i for i in candidates if not marked[i]]
+			candidates.sort(key=lambda i: self.vertexWeights[i])
+			keep = int(math.ceil(len(candidates) * (1 - Kirkpatrick.DEFER_FRACTION)))
+			for i in candidates[keep:]:
+				if (self.vertexWeights[i] > 0):
+					marked[i] = True
+
 		independentSet = []
 
 		# add nodes to independent set and mark it + neighbors
 		# keep adding nodes to set until all nodes are marked
-		for i in xrange(Kirkpatrick.POINT_START, self.N):
+		for i in candidates:
 			# if not marked yet...
 			if not marked[i]:
 				# add to set
@@ -169,104 +217,401 @@ class Kirkpatrick:
 
 		return pieces
 
+	# draw the edges <edges> between points of this structure
 	def drawGraph(self, edges):
-		lines = []
-		for edge in edges:
-			lines.append([self.points[edge[0]], self.points[edge[1]]])
-		lc = mc.LineCollection(lines, linewidths=1)
-		fig, ax = plt.subplots()
-		ax.add_collection(lc)
-		ax.autoscale()
-		ax.margins(0.1)
-		plt.show()
+		import Visualization as vis
+		vis.drawGraph(self.points, edges)
 
 	# find triangle point <q> is in
 	# if not in bounding triangle, returns a dict with key 'inside' set to False
 	# if inside bounding triangle, returns coordinates of triangle in a dict
+	# (corners sorted by coordinates)
 	# dict also has key 'inside' set to true or false depending on whether
 	# located triangle is inside the convex hull of the supplied points
-	def locate(self, q):
-		traveler = self.root
+	# with <insideOnly> set, queries outside the convex hull return {'inside': False} right
+	# away and the search never visits triangles outside the convex hull
+	def locate(self, q, insideOnly=False):
+		if (insideOnly) and (not self.insideHull([q])[0]):
+			return {'inside': False}
+
+		leaf = self._locateLeaf(q, insideOnly)
 
 		# not inside triangle
-		if (not tools.insideTriangle(self.points[traveler.p1], self.points[traveler.p2], self.points[traveler.p3], q)):
+		if (leaf is None):
 			return {'inside': False}
 
+		return self._pieceToLocation(leaf)
+
+	# same as locate() for every point in <queries>, returns a list of dicts
+	# with <insideOnly> set, all queries are checked against the convex hull in one batch first
+	def locateMany(self, queries, insideOnly=False):
+		queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+		if (insideOnly):
+			inside = self.insideHull(queries)
+		else:
+			inside = np.ones(len(queries), dtype=bool)
+
+		locations = []
+		for q, isInside in zip(queries.tolist(), inside):
+			leaf = None
+			if (isInside):
+				leaf = self._locateLeaf(q, insideOnly)
+			if (leaf is None):
+				locations.append({'inside': False})
+			else:
+				locations.append(self._pieceToLocation(leaf))
+		return locations
+
+	# which points of <queries> are inside (or on) the convex hull of the points?
+	# returns a boolean array; each query costs O(log h) for h hull vertices
+	def insideHull(self, queries):
+		return tools.insideConvexPolygon(self.hull, queries)
+
+	# number of point-in-triangle tests locate() makes to find <q>
+	def queryCost(self, q):
+		leaf, tests = self._descend(q)
+		return tests
+
+	# average number of point-in-triangle tests per query over <queries> (0 if there are none)
+	def expectedQueryCost(self, queries):
+		costs = [self.queryCost(q) for q in queries]
+		return sum(costs) / float(max(len(costs), 1))
+
+	# find every triangle of the fine triangulation that segment <a>, <b> passes through
+	# triangles are returned in order from <a> to <b>, each as a dict like the ones from locate()
+	# <a> is located with the DAG, after that the walk steps across shared edges of
+	# <self.untouchedG>, so the cost is O(log N + number of crossed triangles)
+	# the walk stops where the segment leaves the bounding triangle
+	# (empty list if <a> is not inside the bounding triangle)
+	def walkSegment(self, a, b):
+		start = self._locateLeaf(a)
+		if (start is None):
+			return []
+
+		path, reached = self._walk(start, a, b)
+		return [self._pieceToLocation(piece) for piece in path]
+
+	# same as walkSegment() but for the polyline going through <points> in order
+	# the triangle containing a joint between two segments is only listed once, and
+	# each segment starts from where the previous one ended instead of locating again
+	def walkPolyline(self, points):
+		if (len(points) == 0):
+			return []
+
+		start = self._locateLeaf(points[0])
+		if (start is None):
+			return []
+
+		path = [start]
+		for i in xrange(1, len(points)):
+			crossed, reached = self._walk(path[-1], points[i - 1], points[i])
+			path.extend(crossed[1:])
+			# left the bounding triangle, nothing more to walk through
+			if (not reached):
+				break
+
+		return [self._pieceToLocation(piece) for piece in path]
+
+	# get a <LocationCursor> for answering a stream of nearby queries
+	def cursor(self):
+		return LocationCursor(self)
+
+	# get the DAG as a dict of arrays in the format described in <Storage>
+	# leaf ids are positions in <self.untouchedG.pieces>
+	def toArrays(self):
+		leafIds = {}
+		for i, piece in enumerate(self.untouchedG.pieces):
+			leafIds[piece] = i
+
+		# number nodes breadth first from the root
+		nodes = [self.root]
+		nodeIds = {self.root: 0}
+		childStart = [0]
+		children = []
+		for node in nodes:
+			if (not node.leaf()):
+				for child in node.children:
+					if child not in nodeIds:
+						nodeIds[child] = len(nodes)
+						nodes.append(child)
+					children.append(nodeIds[child])
+			childStart.append(len(children))
+
+		arrays = {}
+		arrays['points'] = np.asarray(self.points, dtype=float)
+		arrays['triangles'] = np.array([[node.p1, node.p2, node.p3] for node in nodes], dtype=np.int64)
+		arrays['leaf'] = np.array([leafIds[node] if node.leaf() else -1 for node in nodes], dtype=np.int64)
+		arrays['inside'] = np.array([node.leaf() and node.inside() for node in nodes], dtype=bool)
+		arrays['childStart'] = np.array(childStart, dtype=np.int64)
+		arrays['children'] = np.array(children, dtype=np.int64)
+		return arrays
+
+	# write the DAG to <directory>, it can be queried later with Storage.load()
+	def save(self, directory):
+		storage.saveArrays(directory, self.toArrays())
+
+	# attach a value to every input point (in the order the points were given) for interpolate()
+	# <values> can also be 2D, in which case each column is interpolated
+	def setVertexValues(self, values):
+		values = np.asarray(values, dtype=float)
+		assert (len(values) == self.N - Kirkpatrick.POINT_START)
+		self.values = values
+
+	# locate all points in <queries> and interpolate the vertex values linearly inside
+	# the triangles containing them. Returns a dict with:
+	# 'vertices': M x 3 indices (into the input points) of the containing triangles
+	# 'weights': M x 3 barycentric weights of the queries in those triangles
+	# 'values': the M interpolated values
+	# queries outside the convex hull get vertices -1, weights 0 and value <fillValue>
+	def interpolate(self, queries, fillValue=np.nan):
+		assert (self.values is not None)
+		queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+		M = len(queries)
+
+		# locate queries inside the convex hull, only the rest get <fillValue>
+		# queries on edges or at the input points are found too (the descent is inclusive)
+		triangles = np.zeros((M, 3), dtype=int)
+		found = self.insideHull(queries)
+		for i in np.flatnonzero(found):
+			leaf = self._locateLeaf(queries[i].tolist(), True)
+			assert (leaf is not None)
+			triangles[i] = [leaf.p1, leaf.p2, leaf.p3]
+
+		vertices = np.full((M, 3), -1, dtype=int)
+		weights = np.zeros((M, 3))
+		values = np.full((M,) + self.values.shape[1:], fillValue, dtype=float)
+
+		# barycentric weights for all located queries at once
+		points = np.asarray(self.points)
+		tri = triangles[found]
+		q = queries[found]
+		a = points[tri[:, 0]]
+		b = points[tri[:, 1]]
+		c = points[tri[:, 2]]
+		det = (b[:, 1] - c[:, 1]) * (a[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (a[:, 1] - c[:, 1])
+		w1 = ((b[:, 1] - c[:, 1]) * (q[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (q[:, 1] - c[:, 1])) / det
+		w2 = ((c[:, 1] - a[:, 1]) * (q[:, 0] - c[:, 0]) + (a[:, 0] - c[:, 0]) * (q[:, 1] - c[:, 1])) / det
+		w = np.column_stack((w1, w2, 1 - w1 - w2))
+
+		vertices[found] = tri - Kirkpatrick.POINT_START
+		weights[found] = w
+		values[found] = np.einsum('ij,ij...->i...', w, self.values[vertices[found]])
+
+		return {'vertices': vertices, 'weights': weights, 'values': values}
+
+	# find the leaf piece containing <q> by descending the DAG
+	# returns None if <q> is not inside the bounding triangle
+	# <insideOnly> is for queries already known to be inside the convex hull: leaves outside
+	# the hull are skipped, and None is returned if no leaf inside the hull contains <q>
+	def _locateLeaf(self, q, insideOnly=False):
+		leaf, tests = self._descend(q, insideOnly)
+		return leaf
+
+	# descent behind _locateLeaf(), also returns the number of point-in-triangle tests made
+	# points on edges and corners count as inside, so <q> can be in several children; if the
+	# first one leads nowhere (only skipped leaves contain <q>) the next one is tried
+	def _descend(self, q, insideOnly=False):
+		traveler = self.root
+		tests = 0
+
+		# not inside triangle
+		if (not insideOnly):
+			tests += 1
+			if (not self._contains(traveler, q)):
+				return None, tests
+
 		# inside bounding triangle
-		# find triangle
-		while (not traveler.leaf()):
-			found = False
-			for child in traveler.children:
-				if (tools.insideTriangle(self.points[child.p1], self.points[child.p2], self.points[child.p3], q)):
-					traveler = child;
-					found = True
+		# find triangle, keeping the children left to try at every level
+		# (nodes have several parents, <visited> keeps a dead end from being tried twice)
+		if (traveler.leaf()):
+			return traveler, tests
+		remaining = [iter(traveler.children)]
+		visited = set()
+		while (len(remaining) > 0):
+			for child in remaining[-1]:
+				if (child in visited) or ((insideOnly) and child.leaf() and (not child.inside())):
+					continue
+				visited.add(child)
+				tests += 1
+				if (self._contains(child, q)):
+					if (child.leaf()):
+						return child, tests
+					remaining.append(iter(child.children))
 					break
-			assert (found)
+			else:
+				remaining.pop()
 
-		location = {}
-		location['inside'] = traveler.inside()
-		location['p1'] = self.points[traveler.p1]
-		location['p2'] = self.points[traveler.p2]
-		location['p3'] = self.points[traveler.p3]
+		# children cover their parent, so this only happens for skipped leaves
+		assert (insideOnly)
+		return None, tests
 
+	# is <q> inside (or on the boundary of) <piece>?
+	def _contains(self, piece, q):
+		return tools.insideOrOnTriangle(self.points[piece.p1], self.points[piece.p2], self.points[piece.p3], q)
+
+	# location dict (as returned by locate()) of leaf piece <piece>
+	# the corners are sorted by coordinates, so every locator gives the same dict for a triangle
+	def _pieceToLocation(self, piece):
+		corners = sorted([self.points[piece.p1], self.points[piece.p2], self.points[piece.p3]])
+		location = {}
+		location['inside'] = piece.inside()
+		location['p1'] = corners[0]
+		location['p2'] = corners[1]
+		location['p3'] = corners[2]
 		return location
 
+	# walk across leaf pieces from <start> (the leaf containing <a>) towards <b>
+	# returns the list of pieces visited (starting with <start>) and whether the leaf
+	# containing <b> was reached; gives up after <maxSteps> crossings if given
+	def _walk(self, start, a, b, maxSteps=None):
+		path = [start]
+		visited = set(path)
+		current = start
+
+		while (True):
+			edges = self._edgesFacing(current, b)
+			# <b> is not beyond any edge, so it is in <current>
+			if (len(edges) == 0):
+				return path, True
+			if (maxSteps is not None) and (len(path) > maxSteps):
+				return path, False
+
+			# cross the edge the segment leaves through
+			nextPiece = None
+			for edge in edges:
+				u = self.points[edge[0]]
+				v = self.points[edge[1]]
+				if (tools.area2(a, b, u) * tools.area2(a, b, v) > 0):
+					continue
+				neighbor = self.untouchedG.getNeighborAcrossEdge(current, edge)
+				if (neighbor is not None) and (neighbor not in visited):
+					nextPiece = neighbor
+					break
+
+			# segment leaves the bounding triangle
+			if (nextPiece is None):
+				return path, False
+
+			path.append(nextPiece)
+			visited.add(nextPiece)
+			current = nextPiece
+
+	# get the edges of <piece> that have <q> strictly on their outer side
+	def _edgesFacing(self, piece, q):
+		corners = [piece.p1, piece.p2, piece.p3]
+		edges = []
+		for i in xrange(0, 3):
+			u = self.points[corners[i]]
+			v = self.points[corners[(i + 1) % 3]]
+			w = self.points[corners[(i + 2) % 3]]
+			if (tools.area2(u, v, q) * tools.area2(u, v, w) < 0):
+				edges.append([corners[i], corners[(i + 1) % 3]])
+		return edges
+
 	# same functionality as locate() function
 	# however animates the query as triangles transition from coarse to fine
 	def animatedLocation(self, q):
-		traveler = self.root
-		# not inside triangle
-		if (not tools.insideTriangle(self.points[traveler.p1], self.points[traveler.p2], self.points[traveler.p3], q)):
-			return {'inside': False}
-			
-		# inside bounding triangle
-		# find triangle
-		while (not traveler.leaf()):
-			# create new graph
-			fig = plt.figure()
-			ax = plt.subplot(111)
-			# always draw bounding triangle first
-			vertices = [self.points[0], self.points[1], self.points[2], self.points[0]]
-			bol = patches.Polygon(vertices, True, fill=False)
-			ax.add_patch(bol)
-			found = False
-
-			# find child triangle <q> is in
-			for child in traveler.children:
-				# draw triangle containing <q> as filled
-				if (tools.insideTriangle(self.points[child.p1], self.points[child.p2], self.points[child.p3], q)):
-					traveler = child;
-					found = True
-					self._drawPiece(ax, child, True)
-				# draw other child triangles as unfilled
-				else:
-					i = 0
-					self._drawPiece(ax, child, False)
-			assert (found)
-
-			# finally, draw point
-			ax.plot([q[0]], [q[1]], marker='o', color='k', markersize = 3)
-			ax.autoscale()
-			plt.show()
-			assert (found)
-		
-		location = {}
-		location['inside'] = traveler.inside()
-		location['p1'] = self.points[traveler.p1]
-		location['p2'] = self.points[traveler.p2]
-		location['p3'] = self.points[traveler.p3]
-		return location
-
-	# leave up to caller to show
-	def _drawPiece(self, ax, piece, filled):
-		vertices = [self.points[piece.p1], self.points[piece.p2], self.points[piece.p3], self.points[piece.p1]]
-		bol = None
-		if filled:
-			bol = patches.Polygon(vertices, True, fill=True, fc = 'm', ec = 'k')
-		else:
-			bol = patches.Polygon(vertices, True, fill=False)
-		ax.add_patch(bol)
+		import Visualization as vis
+		return vis.animatedLocation(self, q)
 
 	# draw point on fine graph to show location
 	def showPointOnGraph(self, q):
-		self.untouchedG.drawMeWithPoint(q)
+		import Visualization as vis
+		return vis.showPointOnGraph(self, q)
+
+# compare the average number of point-in-triangle tests per query of a uniform build over
+# <points> and a build weighted by the sample <queries>. The costs are measured on
+# <testQueries> (defaults to <queries>), returns them in a dict with the build times
+def queryCostReport(points, queries, testQueries=None):
+	if (testQueries is None):
+		testQueries = queries
+
+	start = time.time()
+	uniform = Kirkpatrick(points)
+	uniformTime = time.time() - start
+
+	start = time.time()
+	weighted = Kirkpatrick(points, queries)
+	weightedTime = time.time() - start
+
+	report = {}
+	report['uniform'] = uniform.expectedQueryCost(testQueries)
+	report['weighted'] = weighted.expectedQueryCost(testQueries)
+	report['uniformBuildTime'] = uniformTime
+	report['weightedBuildTime'] = weightedTime
+	return report
+
+# stateful locator for streams of queries that fall close to each other (e.g. vehicle traces)
+# each query first checks the leaf triangle returned last time and its neighbors, then walks
+# from that triangle towards the query for a few steps, and only then descends the DAG
+# from the root, so coherent streams cost close to O(1) per query
+class LocationCursor:
+	# max number of triangles the walk may cross before falling back to the DAG
+	MAX_WALK = 16
+
+	def __init__(self, kp):
+		# the <Kirkpatrick> structure being queried
+		self.kp = kp
+		# leaf piece found by the previous query
+		self.last = None
+		# number of queries
+		self.queries = 0
+		# number of queries answered by each stage
+		self.hits = {'last': 0, 'neighbor': 0, 'walk': 0, 'descent': 0}
+
+	# same functionality as Kirkpatrick.locate()
+	def locate(self, q):
+		self.queries += 1
+		leaf = self._locateLeaf(q)
+
+		# not inside bounding triangle
+		if (leaf is None):
+			return {'inside': False}
+
+		return self.kp._pieceToLocation(leaf)
+
+	# fraction of queries answered by each stage
+	def hitRates(self):
+		rates = {}
+		for stage in self.hits:
+			rates[stage] = self.hits[stage] / float(max(self.queries, 1))
+		return rates
+
+	# forget the previous leaf and clear the counters
+	def reset(self):
+		self.last = None
+		self.queries = 0
+		for stage in self.hits:
+			self.hits[stage] = 0
+
+	# find the leaf piece containing <q>, trying the cheap stages first
+	def _locateLeaf(self, q):
+		last = self.last
+
+		if (last is not None):
+			# same triangle as last time
+			if (len(self.kp._edgesFacing(last, q)) == 0):
+				self.hits['last'] += 1
+				return last
+
+			# one of its neighbors
+			for neighbor in self.kp.untouchedG.getAdjacentPieces(last):
+				if (len(self.kp._edgesFacing(neighbor, q)) == 0):
+					self.hits['neighbor'] += 1
+					self.last = neighbor
+					return neighbor
+
+			# short walk from the center of the last triangle
+			points = self.kp.points
+			center = [(points[last.p1][0] + points[last.p2][0] + points[last.p3][0]) / 3.0,
+					  (points[last.p1][1] + points[last.p2][1] + points[last.p3][1]) / 3.0]
+			path, reached = self.kp._walk(last, center, q, LocationCursor.MAX_WALK)
+			if (reached):
+				self.hits['walk'] += 1
+				self.last = path[-1]
+				return path[-1]
+
+		# fall back to the DAG
+		self.hits['descent'] += 1
+		self.last = self.kp._locateLeaf(q)
+		return self.last
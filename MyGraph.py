@@ -1,7 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import Tools as tools
-from matplotlib import collections  as mc
 
 # class used to represent a triangle (with pointers) in the Kirkpatrick point location algorithm
 # a Piece must be associated with a fixed list of points to make sense, as its triangle
@@ -159,6 +157,23 @@ class MyGraph:
 		assert (len(edge) == 2)
 		return self.edgeToFace[edge[0]][edge[1]]
 
+	# get the piece on the other side of edge <edge> from <piece>
+	# returns None if <edge> is on the outer boundary
+	def getNeighborAcrossEdge(self, piece, edge):
+		for face in self.getPieces(edge):
+			if (face is not None) and (not face.equals(piece)):
+				return face
+		return None
+
+	# get the (at most 3) pieces sharing an edge with <piece>
+	def getAdjacentPieces(self, piece):
+		adjacent = []
+		for edge in [[piece.p1, piece.p2], [piece.p2, piece.p3], [piece.p3, piece.p1]]:
+			neighbor = self.getNeighborAcrossEdge(piece, edge)
+			if neighbor is not None:
+				adjacent.append(neighbor)
+		return adjacent
+
 	# given an active point <vertex>, return the polygon "hole" that would exist
 	# if <vertex> were to be deleted. The points are returned in counterclockwise order.
 	def getSurroundingPolygon(self, vertex):
@@ -275,49 +290,10 @@ class MyGraph:
 
 	# draw current pieces
 	def drawMe(self):
-		lines = []
-
-		for i in xrange(0, self.N):
-			for j in xrange(i, self.N):
-				if (self.edgeToFace[i][j][0] is not None):
-					lines.append([self.points[i], self.points[j]])
-				elif (self.edgeToFace[i][j][1] is not None):
-					lines.append([self.points[i], self.points[j]])
-
-		# always draw outer triangle
-		lines.append([self.points[0], self.points[1]])
-		lines.append([self.points[1], self.points[2]])
-		lines.append([self.points[2], self.points[0]])
-
-		lc = mc.LineCollection(lines, linewidths=1)
-		fig, ax = plt.subplots()
-		ax.add_collection(lc)
-		ax.autoscale()
-		ax.margins(0.1)
-		plt.show()
+		import Visualization as vis
+		vis.drawMe(self)
 
 	# draw current pieces with a point (the query)
 	def drawMeWithPoint(self, q):
-		lines = []
-
-		for i in xrange(0, self.N):
-			for j in xrange(i, self.N):
-				if (self.edgeToFace[i][j][0] is not None):
-					lines.append([self.points[i], self.points[j]])
-				elif (self.edgeToFace[i][j][1] is not None):
-					lines.append([self.points[i], self.points[j]])
-
-		# always draw outer triangle
-		lines.append([self.points[0], self.points[1]])
-		lines.append([self.points[1], self.points[2]])
-		lines.append([self.points[2], self.points[0]])
-
-		lc = mc.LineCollection(lines, linewidths=1)
-		fig, ax = plt.subplots()
-		ax.add_collection(lc)
-		ax.plot([q[0]], [q[1]], marker='o', color='k', markersize = 3)
-		ax.autoscale()
-		ax.margins(0.1)
-		plt.show()
-
-		return True
\ No newline at end of file
+		import Visualization as vis
+		return vis.drawMeWithPoint(self, q)
@@ -0,0 +1,429 @@
+import os
+import shutil
+import numpy as np
+from scipy.spatial import Delaunay
+from scipy.spatial import ConvexHull
+import Storage as storage
+import Tools as tools
+from Kirkpatrick import Kirkpatrick
+
+# building and querying Kirkpatrick structures for point files too large to triangulate at once
+# The points are split kd-tree style (at the median of the longer side) until every tile holds at
+# most <chunkSize> points, so dense regions get small tiles. Each tile is built from its own points,
+# the convex hull vertices of all points (so its hull, and its 'inside' flags, are those of all
+# points), a halo of the points around it, and the few outside points needed to make every
+# triangle touching the tile a triangle of the triangulation of all points. Those are found by
+# checking the circumcircles of the triangles touching the tile against the points of the tiles
+# they reach (found with the kd-tree, and read one at a time), and adding points that fall
+# inside until there are none. With the halo the circles are small, so a tile reads about as
+# many tiles as it has neighbors, and the whole build reads O(N) points. Each tile's DAG is
+# written to disk in the <Storage> format before the next tile is read. A query is answered by the DAG of its tile, giving the
+# same triangle as an in-memory build of all points (unless the query is on an edge or at an
+# input point, where any triangle touching it may be given).
+
+# number of points read from a file at a time
+BLOCK_SIZE = 65536
+# max number of points read to estimate a median when splitting
+SAMPLE_SIZE = 65536
+# width of the halo a tile starts with, in point spacings of the tiles around it
+HALO_WIDTH = 2
+# files buildFromFile() writes next to the tile directories
+INDEX_FILES = ['kdAxis.npy', 'kdValue.npy', 'kdLeft.npy', 'kdRight.npy', 'kdTile.npy', 'built.npy', 'hull.npy']
+
+# open point file <path> as an N x 2 memory-mapped array
+# .npy files are opened directly, other files are read as raw x, y pairs of type <dtype>
+def openPoints(path, dtype=np.float64):
+	if path.endswith('.npy'):
+		points = np.load(path, mmap_mode='r')
+	else:
+		points = np.memmap(path, dtype=dtype, mode='r')
+	return points.reshape(-1, 2)
+
+# build the tiled DAGs for the points in file <path> and write them to <directory>
+def buildFromFile(path, directory, chunkSize=2000, dtype=np.float64):
+	assert (chunkSize >= 3)
+	points = openPoints(path, dtype)
+
+	# leftovers of an earlier build would get appended to, or mixed with the new tiles
+	_clear(directory)
+	scratch = os.path.join(directory, 'scratch')
+	os.makedirs(scratch)
+
+	try:
+		# copy the points, getting the bounding box and hull on the way
+		# (they are not rounded here: Kirkpatrick rounds them itself, and rounding twice can move them)
+		rootFile = os.path.join(scratch, 'p')
+		low, high, hull = _copyPoints(points, rootFile)
+
+		# split into tiles
+		tree = {'axis': [], 'value': [], 'left': [], 'right': [], 'tile': []}
+		tiles = []
+		_split(rootFile, [low[0], low[1], high[0], high[1]], chunkSize, tree, tiles)
+
+		# build every tile from its points plus the outside points it needs
+		built = np.zeros(len(tiles), dtype=bool)
+		for i, tile in enumerate(tiles):
+			tilePoints = _gatherTile(i, tree, tiles, hull)
+			if (tilePoints is None):
+				continue
+			kp = Kirkpatrick(tilePoints.tolist())
+			kp.save(_tileDirectory(directory, i))
+			built[i] = True
+	finally:
+		shutil.rmtree(scratch)
+
+	np.save(os.path.join(directory, 'kdAxis.npy'), np.array(tree['axis'], dtype=np.int64))
+	np.save(os.path.join(directory, 'kdValue.npy'), np.array(tree['value'], dtype=float))
+	np.save(os.path.join(directory, 'kdLeft.npy'), np.array(tree['left'], dtype=np.int64))
+	np.save(os.path.join(directory, 'kdRight.npy'), np.array(tree['right'], dtype=np.int64))
+	np.save(os.path.join(directory, 'kdTile.npy'), np.array(tree['tile'], dtype=np.int64))
+	np.save(os.path.join(directory, 'built.npy'), built)
+	np.save(os.path.join(directory, 'hull.npy'), _round(hull))
+
+# class that answers location queries on the tiled DAGs written by buildFromFile()
+# tile DAGs are memory-mapped when first needed, at most <MAX_OPEN> at a time
+class TiledLocator:
+	# max number of tile DAGs kept open
+	MAX_OPEN = 16
+
+	def __init__(self, directory):
+		self.directory = directory
+		# kd-tree over the tiles: node i splits on coordinate kdAxis[i] at kdValue[i], smaller
+		# values go to node kdLeft[i], the rest to kdRight[i]; leaves have tile kdTile[i] >= 0
+		self.kdAxis = np.load(os.path.join(directory, 'kdAxis.npy'))
+		self.kdValue = np.load(os.path.join(directory, 'kdValue.npy'))
+		self.kdLeft = np.load(os.path.join(directory, 'kdLeft.npy'))
+		self.kdRight = np.load(os.path.join(directory, 'kdRight.npy'))
+		self.kdTile = np.load(os.path.join(directory, 'kdTile.npy'))
+		# which tiles have a DAG
+		self.built = np.load(os.path.join(directory, 'built.npy'))
+		# convex hull of all points, counterclockwise
+		self.hull = np.load(os.path.join(directory, 'hull.npy'))
+		# open tile DAGs, least recently used first in <self.openOrder>
+		self.openTiles = {}
+		self.openOrder = []
+
+	# same functionality as Kirkpatrick.locate(q, insideOnly=True): queries outside the convex
+	# hull of all points return {'inside': False}
+	def locate(self, q):
+		return self.locateMany([q])[0]
+
+	# same as locate() for every point in <queries>, returns a list of dicts
+	# all queries are checked against the convex hull in one batch first
+	def locateMany(self, queries):
+		queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+		inside = tools.insideConvexPolygon(self.hull, queries)
+
+		locations = []
+		for q, isInside in zip(queries.tolist(), inside):
+			tile = self._tileOf(q)
+			if (not isInside) or (not self.built[tile]):
+				locations.append({'inside': False})
+			else:
+				locations.append(self._tileLocator(tile).locate(q, True))
+		return locations
+
+	# tile containing <q>
+	def _tileOf(self, q):
+		node = 0
+		while (self.kdTile[node] < 0):
+			if (q[self.kdAxis[node]] < self.kdValue[node]):
+				node = self.kdLeft[node]
+			else:
+				node = self.kdRight[node]
+		return self.kdTile[node]
+
+	# get the DAG of <tile>, opening it if needed
+	def _tileLocator(self, tile):
+		if tile in self.openTiles:
+			self.openOrder.remove(tile)
+		else:
+			if (len(self.openOrder) >= TiledLocator.MAX_OPEN):
+				del self.openTiles[self.openOrder.pop(0)]
+			self.openTiles[tile] = storage.load(_tileDirectory(self.directory, tile))
+		self.openOrder.append(tile)
+		return self.openTiles[tile]
+
+# copy <points> to scratch file <pointFile>
+# returns the bounding box corners and the convex hull (counterclockwise) of the points
+def _copyPoints(points, pointFile):
+	low = np.array([np.inf, np.inf])
+	high = np.array([-np.inf, -np.inf])
+	hull = np.empty((0, 2))
+
+	with open(pointFile, 'wb') as f:
+		for start in xrange(0, len(points), BLOCK_SIZE):
+			block = np.asarray(points[start:start + BLOCK_SIZE], dtype=np.float64)
+			block.tofile(f)
+			low = np.minimum(low, block.min(axis=0))
+			high = np.maximum(high, block.max(axis=0))
+			hull = _hullOf(np.vstack((hull, block)))
+
+	return low, high, hull
+
+# convex hull vertices of <points>, counterclockwise
+# the hull is taken of the points rounded like Kirkpatrick does (so it is the hull every tile
+# DAG gets), but the points are returned unrounded
+# for collinear points just the two ends, which hold the hull of any later points as well
+def _hullOf(points):
+	rounded = _round(points)
+	if (len(points) >= 3) and (not _collinear(rounded)):
+		return points[ConvexHull(rounded).vertices]
+	order = np.lexsort((rounded[:, 1], rounded[:, 0]))
+	return points[[order[0], order[-1]]]
+
+# <points> truncated to the thousandths, the same as Tools.roundPoint()
+def _round(points):
+	return np.trunc(points * 1000) / 1000
+
+# are all <points> on one line?
+def _collinear(points):
+	return np.linalg.matrix_rank(points - points[0]) < 2
+
+# number of points in scratch file <pointFile>
+def _count(pointFile):
+	return os.path.getsize(pointFile) // 16
+
+# read scratch file <pointFile> as an N x 2 memory-mapped array
+def _readPoints(pointFile):
+	if (_count(pointFile) == 0):
+		return np.empty((0, 2))
+	return np.memmap(pointFile, dtype=np.float64, mode='r').reshape(-1, 2)
+
+# split the points in scratch file <pointFile>, lying in <box> (x min, y min, x max, y max),
+# until every part has at most <chunkSize> points
+# adds the nodes to <tree> and the leaves to <tiles>, returns the id of the node made
+def _split(pointFile, box, chunkSize, tree, tiles):
+	node = len(tree['axis'])
+	for name in tree:
+		tree[name].append(-1)
+
+	n = _count(pointFile)
+	if (n > chunkSize):
+		# longer side first
+		axes = [0, 1]
+		if (box[3] - box[1] > box[2] - box[0]):
+			axes = [1, 0]
+
+		for axis in axes:
+			points = _readPoints(pointFile)
+			value = float(np.median(points[::max(1, n // SAMPLE_SIZE), axis]))
+			del points
+
+			leftFile = pointFile + 'l'
+			rightFile = pointFile + 'r'
+			nLeft = _partition(pointFile, axis, value, leftFile, rightFile)
+
+			# both sides got points
+			if (nLeft > 0) and (nLeft < n):
+				os.remove(pointFile)
+				leftBox = list(box)
+				leftBox[axis + 2] = value
+				rightBox = list(box)
+				rightBox[axis] = value
+				tree['axis'][node] = axis
+				tree['value'][node] = value
+				tree['left'][node] = _split(leftFile, leftBox, chunkSize, tree, tiles)
+				tree['right'][node] = _split(rightFile, rightBox, chunkSize, tree, tiles)
+				return node
+
+			os.remove(leftFile)
+			os.remove(rightFile)
+
+	# small enough (or all points equal), make a tile
+	# <bounds> is the bounding box of the points themselves
+	points = _readPoints(pointFile)
+	bounds = [np.inf, np.inf, -np.inf, -np.inf]
+	if (n > 0):
+		bounds = list(points.min(axis=0)) + list(points.max(axis=0))
+	tree['tile'][node] = len(tiles)
+	tiles.append({'box': box, 'bounds': bounds, 'count': n, 'file': pointFile})
+	return node
+
+# write the points of <pointFile> with coordinate <axis> below <value> to <leftFile>,
+# the rest to <rightFile>; returns the number of points on the left
+def _partition(pointFile, axis, value, leftFile, rightFile):
+	points = _readPoints(pointFile)
+	nLeft = 0
+	with open(leftFile, 'wb') as left:
+		with open(rightFile, 'wb') as right:
+			for start in xrange(0, len(points), BLOCK_SIZE):
+				block = np.asarray(points[start:start + BLOCK_SIZE])
+				isLeft = block[:, axis] < value
+				block[isLeft].tofile(left)
+				block[~isLeft].tofile(right)
+				nLeft += int(isLeft.sum())
+	return nLeft
+
+# get the points to build tile number <tile> of <tiles> from: its own, the hull vertices <hull>
+# of all points, a halo, and the outside points its triangles need (see top of file)
+# <tree> is the kd-tree over the tiles, used to read only the tiles near the tile or a circle
+# returns None if the points can't be triangulated at all (fewer than 3, or all collinear)
+def _gatherTile(tile, tree, tiles, hull):
+	# tiles read while gathering this tile, kept until it is done (they are mostly its neighbors)
+	read = {}
+	parts = [_tilePoints(tile, tiles, read), hull]
+
+	# start with a halo of the points of the tiles touching this one, a band of about
+	# HALO_WIDTH times their point spacing around the tile, so the circles checked are small
+	box = tiles[tile]['box']
+	for other in _tilesInBox(tree, 0, box):
+		if (other == tile):
+			continue
+		others = _tilePoints(other, tiles, read)
+		width = HALO_WIDTH * _spacing(tiles[other])
+		isNear = (others[:, 0] >= box[0] - width) & (others[:, 0] <= box[2] + width) & (others[:, 1] >= box[1] - width) & (others[:, 1] <= box[3] + width)
+		parts.append(others[isNear])
+
+	points = np.unique(np.vstack(parts), axis=0)
+	if (len(points) < 3) or _collinear(_round(points)):
+		return None
+
+	while (True):
+		missing = _missingPoints(points, tile, tree, tiles, read)
+		if (len(missing) == 0):
+			return points
+		points = np.unique(np.vstack((points, missing)), axis=0)
+
+# get points of other tiles that are inside the circumcircle of a Delaunay triangle of <points>
+# touching tile number <tile>, one for each such circle (the next triangulation drops its triangle)
+# only the tiles the circles reach are looked at (read into <read> if they aren't yet); the ones
+# read already go first, then the nearest, so even a large circle seldom reads another tile
+def _missingPoints(points, tile, tree, tiles, read):
+	box = tiles[tile]['box']
+	corners = points[Delaunay(points).simplices]
+	centers, radii = _circumcircles(corners[_touches(corners, box)])
+
+	reached = {}
+	_tilesReached(tree, 0, tiles, centers, radii, np.arange(len(radii)), reached)
+	reachedBy = {}
+	for other in reached:
+		# all of the tile's own points are in <points> already
+		if (other == tile):
+			continue
+		for circle in reached[other]:
+			reachedBy.setdefault(circle, []).append(other)
+
+	missing = [np.empty((0, 2))]
+	for circle in sorted(reachedBy):
+		center = centers[circle]
+		candidates = sorted(reachedBy[circle], key=lambda other: (other not in read, _distance(center, tiles[other]['bounds'])))
+		for other in candidates:
+			others = _tilePoints(other, tiles, read)
+			distances = np.hypot(others[:, 0] - center[0], others[:, 1] - center[1])
+			# points on the circle leave the triangulation free to choose, they don't count
+			# (this also skips points already in <points>, which are never inside)
+			closest = np.argmin(distances)
+			if (distances[closest] < radii[circle] * (1 - 1e-9)):
+				missing.append(others[closest:closest + 1])
+				break
+
+	return np.vstack(missing)
+
+# distance from <point> to the box <bounds> (x min, y min, x max, y max)
+def _distance(point, bounds):
+	return np.hypot(point[0] - np.clip(point[0], bounds[0], bounds[2]), point[1] - np.clip(point[1], bounds[1], bounds[3]))
+
+# points of tile number <tile>, from <read> if it was read already (and added to it if not)
+def _tilePoints(tile, tiles, read):
+	if tile not in read:
+		read[tile] = np.array(_readPoints(tiles[tile]['file']))
+	return read[tile]
+
+# typical distance between neighboring points of <tile>
+def _spacing(tile):
+	bounds = tile['bounds']
+	area = max(bounds[2] - bounds[0], 0) * max(bounds[3] - bounds[1], 0)
+	return np.sqrt(area / max(tile['count'], 1))
+
+# tiles below node <node> of kd-tree <tree> whose box overlaps or touches <box>
+# (x min, y min, x max, y max)
+def _tilesInBox(tree, node, box):
+	if (tree['tile'][node] >= 0):
+		return [tree['tile'][node]]
+
+	axis = tree['axis'][node]
+	value = tree['value'][node]
+	found = []
+	if (box[axis] <= value):
+		found += _tilesInBox(tree, tree['left'][node], box)
+	if (box[axis + 2] >= value):
+		found += _tilesInBox(tree, tree['right'][node], box)
+	return found
+
+# find which of the circles <centers>, <radii> numbered <circles> reach the points of the tiles
+# below node <node> of kd-tree <tree>; adds them to <reached> as tile: array of circle numbers
+def _tilesReached(tree, node, tiles, centers, radii, circles, reached):
+	if (len(circles) == 0):
+		return
+
+	tile = tree['tile'][node]
+	if (tile >= 0):
+		# circles reaching the bounding box of its points
+		bounds = tiles[tile]['bounds']
+		if (bounds[0] > bounds[2]):
+			return
+		nearX = np.clip(centers[circles, 0], bounds[0], bounds[2])
+		nearY = np.clip(centers[circles, 1], bounds[1], bounds[3])
+		reaching = np.hypot(centers[circles, 0] - nearX, centers[circles, 1] - nearY) < radii[circles]
+		if np.any(reaching):
+			reached[tile] = circles[reaching]
+		return
+
+	axis = tree['axis'][node]
+	value = tree['value'][node]
+	low = centers[circles, axis] - radii[circles]
+	high = centers[circles, axis] + radii[circles]
+	_tilesReached(tree, tree['left'][node], tiles, centers, radii, circles[low < value], reached)
+	_tilesReached(tree, tree['right'][node], tiles, centers, radii, circles[high >= value], reached)
+
+# which <triangles> (K x 3 x 2) overlap or touch <box>?
+# they do unless their bounding boxes are apart or one of their edges has the whole box outside
+def _touches(triangles, box):
+	low = triangles.min(axis=1)
+	high = triangles.max(axis=1)
+	touching = (low[:, 0] <= box[2]) & (high[:, 0] >= box[0]) & (low[:, 1] <= box[3]) & (high[:, 1] >= box[1])
+
+	boxCorners = np.array([[box[0], box[1]], [box[2], box[1]], [box[2], box[3]], [box[0], box[3]]])
+	for i in xrange(0, 3):
+		a = triangles[:, i]
+		b = triangles[:, (i + 1) % 3]
+		c = triangles[:, (i + 2) % 3]
+		inner = _side(a, b, c)
+		outside = np.ones(len(triangles), dtype=bool)
+		for corner in boxCorners:
+			outside &= _side(a, b, corner) * inner < 0
+		touching &= ~outside
+	return touching
+
+# which side of the lines <a>, <b> (K x 2) are the points <c>? (twice the signed area)
+def _side(a, b, c):
+	return (b[:, 0] - a[:, 0]) * (c[..., 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[..., 0] - a[:, 0])
+
+# centers and radii of the circumcircles of <triangles> (K x 3 x 2)
+def _circumcircles(triangles):
+	a = triangles[:, 0]
+	b = triangles[:, 1] - a
+	c = triangles[:, 2] - a
+	d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+	bb = b[:, 0] ** 2 + b[:, 1] ** 2
+	cc = c[:, 0] ** 2 + c[:, 1] ** 2
+	x = (c[:, 1] * bb - b[:, 1] * cc) / d
+	y = (b[:, 0] * cc - c[:, 0] * bb) / d
+	return a + np.column_stack((x, y)), np.hypot(x, y)
+
+# remove what an earlier buildFromFile() wrote to <directory>: the scratch files, the tile
+# DAGs and the index files (anything else in <directory> is left alone)
+def _clear(directory):
+	if not os.path.isdir(directory):
+		return
+	for name in os.listdir(directory):
+		path = os.path.join(directory, name)
+		if (name == 'scratch') or (name.startswith('tile_') and os.path.isdir(path)):
+			shutil.rmtree(path)
+		elif name in INDEX_FILES:
+			os.remove(path)
+
+# directory the DAG of tile <tile> is saved in
+def _tileDirectory(directory, tile):
+	return os.path.join(directory, 'tile_' + str(tile))
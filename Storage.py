@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import Tools as tools
+
+# on-disk format for a Kirkpatrick DAG
+# a DAG is stored as a directory with one .npy file per array, so that it can be memory-mapped
+# instead of read into memory. Node 0 is the root (the bounding triangle). Arrays:
+# 'points': N x 2 coordinates, bounding triangle first
+# 'triangles': K x 3 indices into 'points' of the triangle of each node
+# 'leaf': K leaf ids (index into the fine triangulation), -1 for nodes that are not leaves
+# 'inside': K booleans, is the leaf inside the convex hull of the points?
+# 'childStart', 'children': children of node i are children[childStart[i]:childStart[i + 1]]
+ARRAYS = ['points', 'triangles', 'leaf', 'inside', 'childStart', 'children']
+
+# write dict of arrays <arrays> to <directory>
+def saveArrays(directory, arrays):
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	for name in ARRAYS:
+		np.save(os.path.join(directory, name + '.npy'), arrays[name])
+
+# read the arrays saved in <directory>, memory-mapped unless <mmap> is False
+def loadArrays(directory, mmap=True):
+	arrays = {}
+	for name in ARRAYS:
+		arrays[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+	return arrays
+
+# load the DAG saved in <directory> for querying
+def load(directory, mmap=True):
+	return ArrayLocator(loadArrays(directory, mmap))
+
+# class that performs the location queries of <Kirkpatrick> on a DAG stored as arrays
+# (see top of file), either in memory or memory-mapped from disk
+class ArrayLocator:
+	def __init__(self, arrays):
+		self.points = arrays['points']
+		self.triangles = arrays['triangles']
+		self.leaf = arrays['leaf']
+		self.isInside = arrays['inside']
+		self.childStart = arrays['childStart']
+		self.children = arrays['children']
+
+	# same functionality as Kirkpatrick.locate(), except that with <insideOnly> the caller
+	# must have checked that <q> is inside the convex hull (there is no hull stored)
+	def locate(self, q, insideOnly=False):
+		node = self.locateNode(q, insideOnly)
+
+		# not inside triangle
+		if (node < 0):
+			return {'inside': False}
+
+		# corners sorted by coordinates, like Kirkpatrick.locate()
+		corners = sorted(self.points[self.triangles[node]].tolist())
+		location = {}
+		location['inside'] = bool(self.isInside[node])
+		location['p1'] = corners[0]
+		location['p2'] = corners[1]
+		location['p3'] = corners[2]
+		return location
+
+	# same as locate() for every point in <queries>, returns a list of dicts
+	def locateMany(self, queries, insideOnly=False):
+		return [self.locate(q, insideOnly) for q in np.asarray(queries, dtype=float).reshape(-1, 2).tolist()]
+
+	# find the leaf node containing <q> by descending the DAG, the same way as
+	# Kirkpatrick._locateLeaf() (points on edges and corners count as inside)
+	# returns -1 if <q> is not inside the bounding triangle, or with <insideOnly>, if no leaf
+	# inside the convex hull contains it
+	def locateNode(self, q, insideOnly=False):
+		node = 0
+
+		# not inside triangle
+		if (not insideOnly) and (not self._insideNode(node, q)):
+			return -1
+
+		# inside bounding triangle
+		# find triangle, keeping the children left to try at every level
+		# (nodes have several parents, <visited> keeps a dead end from being tried twice)
+		if (self.leaf[node] >= 0):
+			return node
+		remaining = [iter(xrange(self.childStart[node], self.childStart[node + 1]))]
+		visited = set()
+		while (len(remaining) > 0):
+			for i in remaining[-1]:
+				child = int(self.children[i])
+				if (child in visited) or ((insideOnly) and (self.leaf[child] >= 0) and (not self.isInside[child])):
+					continue
+				visited.add(child)
+				if (self._insideNode(child, q)):
+					if (self.leaf[child] >= 0):
+						return child
+					remaining.append(iter(xrange(self.childStart[child], self.childStart[child + 1])))
+					break
+			else:
+				remaining.pop()
+
+		# children cover their parent, so this only happens for skipped leaves
+		assert (insideOnly)
+		return -1
+
+	# is <q> inside (or on the boundary of) the triangle of node <node>?
+	def _insideNode(self, node, q):
+		triangle = self.triangles[node]
+		return tools.insideOrOnTriangle(self.points[triangle[0]], self.points[triangle[1]], self.points[triangle[2]], q)
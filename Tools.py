@@ -1,9 +1,6 @@
 import math
 import sys
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import collections  as mc
-from scipy.spatial import Delaunay
 from tri.delaunay import ToPointsAndSegments, triangulate
 from tri.delaunay import output_triangles, TriangleIterator, InteriorTriangleIterator
 
@@ -94,15 +91,8 @@ def angle(a, b, c):
 
 # draw a graph based on points and edges
 def drawGraph(points, edges):
-	lines = []
-	for edge in edges:
-		lines.append([points[edge[0]], points[edge[1]]])
-	lc = mc.LineCollection(lines, linewidths=1)
-	fig, ax = plt.subplots()
-	ax.add_collection(lc)
-	ax.autoscale()
-	ax.margins(0.1)
-	plt.show()
+	import Visualization as vis
+	vis.drawGraph(points, edges)
 
 # check if <q> lies inside triangle formed by the three points <a>, <b>, <c>
 def insideTriangle(a, b, c, q):
@@ -115,6 +105,62 @@ def insideTriangle(a, b, c, q):
 		return True;
 	return False;
 
+# same as insideTriangle() but points on the edges or corners count as inside
+def insideOrOnTriangle(a, b, c, q):
+	side1 = edgeSide(a, b, q)
+	side2 = edgeSide(b, c, q)
+	side3 = edgeSide(c, a, q)
+	return ((side1 >= 0) and (side2 >= 0) and (side3 >= 0)) or ((side1 <= 0) and (side2 <= 0) and (side3 <= 0))
+
+# same as area2() but always rounded the same way for both directions of the segment <a>, <b>,
+# so two triangles sharing an edge never both put a point on that edge outside
+def edgeSide(a, b, c):
+	if (a[0] < b[0]) or ((a[0] == b[0]) and (a[1] < b[1])):
+		return area2(a, b, c)
+	return -area2(b, a, c)
+
+# edgeSide() for arrays: <a>, <b>, <c> are K x 2 (or broadcast against each other)
+def edgeSides(a, b, c):
+	a, b = np.broadcast_arrays(a, b)
+	swap = (a[..., 0] > b[..., 0]) | ((a[..., 0] == b[..., 0]) & (a[..., 1] > b[..., 1]))
+	low = np.where(swap[..., None], b, a)
+	high = np.where(swap[..., None], a, b)
+	sides = (high[..., 0] - low[..., 0]) * (c[..., 1] - low[..., 1]) - (c[..., 0] - low[..., 0]) * (high[..., 1] - low[..., 1])
+	return np.where(swap, -sides, sides)
+
+# which points of <queries> are inside (or on) the convex polygon <polygon>?
+# <polygon> lists its vertices in counterclockwise order; returns a boolean array
+# polygons of less than 3 vertices have nothing inside
+# binary searches the fan of triangles around the first vertex, so O(log h) per query for h vertices
+def insideConvexPolygon(polygon, queries):
+	queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+	hull = np.asarray(polygon, dtype=float)
+	h = len(hull)
+	if (h < 3):
+		return np.zeros(len(queries), dtype=bool)
+
+	# the polygon is a fan of triangles around hull[0]
+	# binary search for the wedge hull[0], hull[lo], hull[lo + 1] each query falls in
+	d = queries - hull[0]
+	v = hull - hull[0]
+	lo = np.ones(len(queries), dtype=int)
+	hi = np.full(len(queries), h - 1, dtype=int)
+	while (np.any(hi - lo > 1)):
+		mid = (lo + hi) // 2
+		left = v[mid, 0] * d[:, 1] - v[mid, 1] * d[:, 0] >= 0
+		lo = np.where(left, mid, lo)
+		hi = np.where(left, hi, mid)
+
+	# inside the fan at all?
+	# the polygon edges are tested with edgeSides() so triangles along them agree with the result
+	first = edgeSides(hull[0], hull[1], queries) >= 0
+	last = edgeSides(hull[h - 1], hull[0], queries) >= 0
+
+	# on the inner side of the polygon edge closing the wedge?
+	inner = edgeSides(hull[lo], hull[lo + 1], queries) >= 0
+
+	return first & last & inner
+
 # do the two line segments <a> and <b> intersect?
 def segmentIntersect(a, b):
 	assert (len(a) == 2)
@@ -0,0 +1,113 @@
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+from matplotlib import collections  as mc
+import Tools as tools
+
+# drawing functions for the Kirkpatrick point location structures
+# kept separate from the core modules so that locating points does not need to load matplotlib;
+# <Kirkpatrick>, <MyGraph> and <Tools> only import this module when one of their drawing methods is called
+
+# draw a graph based on points and edges
+def drawGraph(points, edges):
+	lines = []
+	for edge in edges:
+		lines.append([points[edge[0]], points[edge[1]]])
+	lc = mc.LineCollection(lines, linewidths=1)
+	fig, ax = plt.subplots()
+	ax.add_collection(lc)
+	ax.autoscale()
+	ax.margins(0.1)
+	plt.show()
+
+# get the lines of all edges currently in <graph>, plus the outer triangle
+def _graphLines(graph):
+	lines = []
+
+	for i in xrange(0, graph.N):
+		for j in xrange(i, graph.N):
+			if (graph.edgeToFace[i][j][0] is not None):
+				lines.append([graph.points[i], graph.points[j]])
+			elif (graph.edgeToFace[i][j][1] is not None):
+				lines.append([graph.points[i], graph.points[j]])
+
+	# always draw outer triangle
+	lines.append([graph.points[0], graph.points[1]])
+	lines.append([graph.points[1], graph.points[2]])
+	lines.append([graph.points[2], graph.points[0]])
+
+	return lines
+
+# draw current pieces of <graph>
+def drawMe(graph):
+	lc = mc.LineCollection(_graphLines(graph), linewidths=1)
+	fig, ax = plt.subplots()
+	ax.add_collection(lc)
+	ax.autoscale()
+	ax.margins(0.1)
+	plt.show()
+
+# draw current pieces of <graph> with a point (the query)
+def drawMeWithPoint(graph, q):
+	lc = mc.LineCollection(_graphLines(graph), linewidths=1)
+	fig, ax = plt.subplots()
+	ax.add_collection(lc)
+	ax.plot([q[0]], [q[1]], marker='o', color='k', markersize = 3)
+	ax.autoscale()
+	ax.margins(0.1)
+	plt.show()
+
+	return True
+
+# draw <piece> of a triangulation over <points> onto <ax>
+# leave up to caller to show
+def drawPiece(ax, points, piece, filled):
+	vertices = [points[piece.p1], points[piece.p2], points[piece.p3], points[piece.p1]]
+	bol = None
+	if filled:
+		bol = patches.Polygon(vertices, True, fill=True, fc = 'm', ec = 'k')
+	else:
+		bol = patches.Polygon(vertices, True, fill=False)
+	ax.add_patch(bol)
+
+# same functionality as Kirkpatrick.locate() for the structure <kp>
+# however animates the query as triangles transition from coarse to fine
+def animatedLocation(kp, q):
+	traveler = kp.root
+	# not inside triangle
+	if (not tools.insideTriangle(kp.points[traveler.p1], kp.points[traveler.p2], kp.points[traveler.p3], q)):
+		return {'inside': False}
+
+	# inside bounding triangle
+	# find triangle
+	while (not traveler.leaf()):
+		# create new graph
+		fig = plt.figure()
+		ax = plt.subplot(111)
+		# always draw bounding triangle first
+		vertices = [kp.points[0], kp.points[1], kp.points[2], kp.points[0]]
+		bol = patches.Polygon(vertices, True, fill=False)
+		ax.add_patch(bol)
+		found = False
+
+		# find child triangle <q> is in
+		for child in traveler.children:
+			# draw triangle containing <q> as filled
+			if (tools.insideTriangle(kp.points[child.p1], kp.points[child.p2], kp.points[child.p3], q)):
+				traveler = child;
+				found = True
+				drawPiece(ax, kp.points, child, True)
+			# draw other child triangles as unfilled
+			else:
+				drawPiece(ax, kp.points, child, False)
+		assert (found)
+
+		# finally, draw point
+		ax.plot([q[0]], [q[1]], marker='o', color='k', markersize = 3)
+		ax.autoscale()
+		plt.show()
+
+	return kp._pieceToLocation(traveler)
+
+# draw point on fine graph of <kp> to show location
+def showPointOnGraph(kp, q):
+	drawMeWithPoint(kp.untouchedG, q)
@@ -0,0 +1,30 @@
+import os
+import sys
+import subprocess
+import unittest
+
+# max seconds allowed for importing the core locator
+IMPORT_BUDGET = 0.5
+
+# import the core modules in a fresh interpreter and print the import time
+# and whether matplotlib got loaded along the way
+IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import Kirkpatrick
+elapsed = time.time() - start
+print(repr((elapsed, 'matplotlib' in sys.modules)))
+"""
+
+# checks that the core locator stays import-light: drawing code (and matplotlib) is only
+# loaded on demand from <Visualization>
+class TestImport(unittest.TestCase):
+	def test_core_import_is_headless_and_fast(self):
+		here = os.path.dirname(os.path.abspath(__file__))
+		output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], cwd=here)
+		elapsed, loadedMatplotlib = eval(output.decode().strip())
+		self.assertFalse(loadedMatplotlib)
+		self.assertLess(elapsed, IMPORT_BUDGET)
+
+if __name__ == "__main__":
+	unittest.main()